@@ -2,4 +2,4 @@ from . import _import_wrapper
 
 __getattr__ = _import_wrapper.__getattr__
 
-DB_REVISION = '8f6ba74cfa82'
+DB_REVISION = '6e90c6b99464'
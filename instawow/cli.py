@@ -3,7 +3,7 @@ from __future__ import annotations
 from functools import partial
 from itertools import chain, islice
 from pathlib import Path
-from textwrap import dedent, fill
+from textwrap import TextWrapper
 from typing import (TYPE_CHECKING, Any, Callable, FrozenSet, Generator, Iterable, List, Mapping,
                     Optional, Sequence, Tuple, Union, cast, overload)
 
@@ -22,30 +22,44 @@ class Report:
     _success = click.style('✓', fg='green')
     _failure = click.style('✗', fg='red')
     _warning = click.style('!', fg='blue')
+    _success_prefix = f'{_success} '
+    _failure_prefix = f'{_failure} '
+    _warning_prefix = f'{_warning} '
+    _message_wrapper = TextWrapper(initial_indent='  ', subsequent_indent='  ',
+                                   break_on_hyphens=False)
 
     def __init__(self, results: Mapping[Defn, E.ManagerResult],
                  filter_fn: Callable[[E.ManagerResult], bool] = lambda _: True) -> None:
         self.results = results
         self.filter_fn = filter_fn
 
+    @cached_property
+    def _rendered(self) -> Tuple[str, int]:
+        # Render the report and compute the exit code in a single pass
+        filter_fn = self.filter_fn
+        fill = self._message_wrapper.fill
+        parts: List[str] = []
+        code = 0
+        for a, r in self.results.items():
+            if not filter_fn(r):
+                continue
+
+            # Success is the common case so it's checked for first
+            if not isinstance(r, (E.ManagerError, E.InternalError)):
+                prefix = self._success_prefix
+            else:
+                code = 1
+                prefix = (self._warning_prefix if isinstance(r, E.InternalError)
+                          else self._failure_prefix)
+            parts += (prefix, click.style(str(a), bold=True), '\n', fill(r.message), '\n')
+        return ''.join(parts).rstrip('\n'), code
+
     @property
     def code(self) -> int:
-        return any(r for r in self.results.values()
-                   if isinstance(r, (E.ManagerError, E.InternalError))
-                   and self.filter_fn(r))
+        return self._rendered[1]
 
     def __str__(self) -> str:
-        def _adorn_result(result: E.ManagerResult) -> str:
-            if isinstance(result, E.InternalError):
-                return self._warning
-            elif isinstance(result, E.ManagerError):
-                return self._failure
-            return self._success
-
-        return '\n'.join(f'{_adorn_result(r)} {click.style(str(a), bold=True)}\n'
-                         + fill(r.message, initial_indent='  ', subsequent_indent='  ')
-                         for a, r in self.results.items()
-                         if self.filter_fn(r))
+        return self._rendered[0]
 
     def generate(self) -> None:
         manager: CliManager = click.get_current_context().obj.m
@@ -90,24 +104,13 @@ class ManagerWrapper:
         setup_logging(config.logger_dir, 'DEBUG' if self.debug else 'INFO')
         db_session = prepare_db_session(config)
         manager = CliManager(config, db_session)
+        click.get_current_context().call_on_close(manager.close)
         return manager
 
 M = ManagerWrapper
 
 
-@overload
-def parse_into_defn(manager: CliManager, value: str,
-                    *, raise_invalid: bool = True) -> Defn: ...
-@overload
-def parse_into_defn(manager: CliManager, value: Sequence[str],
-                    *, raise_invalid: bool = True) -> List[Defn]: ...
-
-def parse_into_defn(manager: CliManager, value: Sequence[str],
-                    *, raise_invalid: bool = True) -> Union[Defn, List[Defn]]:
-    if not isinstance(value, str):
-        defns = (parse_into_defn(manager, v, raise_invalid=raise_invalid) for v in value)
-        return uniq(defns)
-
+def _parse_one_defn(manager: CliManager, value: str, *, raise_invalid: bool = True) -> Defn:
     delim = ':'
     any_source = '*'
     if delim not in value:
@@ -121,42 +124,64 @@ def parse_into_defn(manager: CliManager, value: Sequence[str],
     return Defn(*parts)
 
 
-def parse_into_defn_with_strategy(manager: CliManager, value: Sequence[Tuple[str, str]]) -> List[Defn]:
-    defns = parse_into_defn(manager, [d for _, d in value])
-    strategies = (Strategies[s] for s, _ in value)
-    return list(map(Defn.with_strategy, defns, strategies))
+@overload
+def parse_into_defn(manager: CliManager, value: str,
+                    *, raise_invalid: bool = True) -> Defn: ...
+@overload
+def parse_into_defn(manager: CliManager, value: Sequence[str],
+                    *, raise_invalid: bool = True) -> List[Defn]: ...
+
+def parse_into_defn(manager: CliManager, value: Sequence[str],
+                    *, raise_invalid: bool = True) -> Union[Defn, List[Defn]]:
+    if isinstance(value, str):
+        return _parse_one_defn(manager, value, raise_invalid=raise_invalid)
+    return list(dict.fromkeys(_parse_one_defn(manager, v, raise_invalid=raise_invalid)
+                              for v in value))
+
+
+_strategies_by_name = {s.name: s for s in Strategies}
+
+
+def parse_into_defn_with_strategy(manager: CliManager, value: Iterable[Tuple[str, str]]) -> List[Defn]:
+    return uniq(_parse_one_defn(manager, d).with_strategy(_strategies_by_name[s])
+                for s, d in value)
 
 
 def export_to_csv(pkgs: Sequence[models.Pkg], path: Path) -> None:
     "Export packages to CSV."
     import csv
 
-    with Path(path).open('w', encoding='utf-8', newline='') as file:
+    with Path(path).open('w', encoding='utf-8', newline='', buffering=2 ** 20) as file:
         writer = csv.writer(file)
         writer.writerow(('defn', 'strategy'))
-        writer.writerows((p.to_defn(), p.options.strategy) for p in pkgs)
+        writer.writerows((str(p.to_defn()), p.options.strategy) for p in pkgs)
 
 
 def import_from_csv(manager: CliManager, path: Path) -> List[Defn]:
     "Import definitions from CSV."
     import csv
 
-    with Path(path).open(encoding='utf-8', newline='') as contents:
-        rows = [(b, a) for a, b in islice(csv.reader(contents), 1, None)]
-    return parse_into_defn_with_strategy(manager, rows)
+    with Path(path).open(encoding='utf-8', newline='', buffering=2 ** 20) as contents:
+        rows = ((b, a) for a, b in islice(csv.reader(contents), 1, None))
+        return parse_into_defn_with_strategy(manager, rows)
+
+
+def _call_with_manager(ctx: click.Context, param: Any, value: Any, *, fn: Callable) -> Any:
+    return fn(ctx.obj.m, value)
+
+
+def _combine(ctx: click.Context, param: Any, value: Any, *, param_name: str, fn: Callable) -> None:
+    addons = ctx.params.setdefault(param_name, [])
+    if value:
+        addons.extend(fn(ctx.obj.m, value))
 
 
 def _callbackify(fn: Callable) -> Callable:
-    return lambda c, p, v: fn(c.obj.m, v)
+    return partial(_call_with_manager, fn=fn)
 
 
 def _combine_into(param_name: str, fn: Callable) -> Callable:
-    def combine(ctx: click.Context, param: Any, value: Any) -> None:
-        addons = ctx.params.setdefault(param_name, [])
-        if value:
-            addons.extend(fn(ctx.obj.m, value))
-
-    return combine
+    return partial(_combine, param_name=param_name, fn=fn)
 
 
 def _show_version(ctx: click.Context, param: Any, value: bool) -> None:
@@ -191,7 +216,7 @@ def main(ctx: click.Context, debug: bool) -> None:
               help='Install add-ons from CSV.')
 @click.option('--with-strategy', '-s',
               multiple=True,
-              type=(click.Choice([s.name for s in Strategies]), str),
+              type=(click.Choice(list(_strategies_by_name)), str),
               callback=_combine_into('addons', parse_into_defn_with_strategy), expose_value=False,
               metavar='<STRATEGY ADDON>...',
               help='A strategy followed by an add-on definition.  '
@@ -239,6 +264,24 @@ def remove(obj: M, addons: Sequence[Defn]) -> None:
     Report(results).generate_and_exit()
 
 
+_reconcile_preamble = '''\
+Use the arrow keys to navigate, <o> to open an add-on in your browser,
+enter to make a selection and <s> to skip to the next item.
+
+Versions that differ from the installed version or differ between
+choices are highlighted in purple.
+
+The reconciler will perform three passes in decreasing order of accuracy,
+looking to match source IDs and add-on names in TOC files, and folders.
+
+Selected add-ons will be reinstalled.
+
+You can also run `reconcile` in promptless mode by passing
+the `--auto` flag.  In this mode, add-ons will be reconciled
+without user input.
+'''
+
+
 @main.command()
 @click.option('--auto', '-a',
               is_flag=True, default=False,
@@ -247,26 +290,8 @@ def remove(obj: M, addons: Sequence[Defn]) -> None:
 def reconcile(ctx: click.Context, auto: bool) -> None:
     "Reconcile pre-installed add-ons."
     from .matchers import AddonFolder, match_toc_ids, match_toc_names, match_dir_names, get_folders
-    from .models import is_pkg
     from .prompts import PkgChoice, confirm, select, skip
 
-    preamble = dedent('''\
-        Use the arrow keys to navigate, <o> to open an add-on in your browser,
-        enter to make a selection and <s> to skip to the next item.
-
-        Versions that differ from the installed version or differ between
-        choices are highlighted in purple.
-
-        The reconciler will perform three passes in decreasing order of accuracy,
-        looking to match source IDs and add-on names in TOC files, and folders.
-
-        Selected add-ons will be reinstalled.
-
-        You can also run `reconcile` in promptless mode by passing
-        the `--auto` flag.  In this mode, add-ons will be reconciled
-        without user input.
-        ''')
-
     manager: CliManager = ctx.obj.m
 
     def prompt_one(addons: List[AddonFolder], pkgs: List[models.Pkg]) -> Union[Defn, Tuple[()]]:
@@ -288,7 +313,7 @@ def reconcile(ctx: click.Context, auto: bool) -> None:
     def prompt(groups: Iterable[Tuple[List[AddonFolder], FrozenSet[Defn]]]) -> Iterable[Defn]:
         results = manager.run(manager.resolve(list({d for _, b in groups for d in b})))
         for addons, defns in groups:
-            shortlist = list(filter(is_pkg, (results[d] for d in defns)))
+            shortlist = list(filter(models.is_pkg, (results[d] for d in defns)))
             if shortlist:
                 if auto:
                     pkg = shortlist[0]      # TODO: something more sophisticated
@@ -310,7 +335,7 @@ def reconcile(ctx: click.Context, auto: bool) -> None:
         click.echo('No add-ons left to reconcile.')
         return
     if not auto:
-        click.echo(preamble)
+        click.echo(_reconcile_preamble)
 
     matcher = match_all()
     for _ in matcher:   # Skip over consumer yields
@@ -363,35 +388,46 @@ def search(ctx: click.Context, limit: int, search_terms: str) -> None:
 @click.pass_obj
 def list_(obj: M, addons: Sequence[Defn], export: Optional[str], output_format: str) -> None:
     "List installed add-ons."
-    from sqlalchemy import and_, or_
-
-    def format_deps(pkg: models.Pkg):
-        deps = (Defn(pkg.source, d.id) for d in pkg.deps)
-        deps = (d.with_name(getattr(obj.m.get(d), 'slug', d.name)) for d in deps)
-        return map(str, deps)
-
-    def get_desc(pkg: models.Pkg):
-        if pkg.source == 'wowi':
-            toc_reader = TocReader.from_path_name(obj.m.config.addon_dir / pkg.folders[0].name)
-            return toc_reader['Notes'].value
+    import sqlite3
+    from sqlalchemy import and_, or_, tuple_
+
+    # Substring matches can't be batched; exact (source, id or slug) matches
+    # are folded into two row-value ``IN`` clauses
+    clauses = [models.Pkg.slug.contains(n) for s, n, _ in addons if s == '*']
+    pairs = [(s, n) for s, n, _ in addons if s != '*']
+    if pairs:
+        # Row values are only supported from SQLite 3.15 onwards
+        if sqlite3.sqlite_version_info >= (3, 15):
+            clauses += (tuple_(models.Pkg.source, models.Pkg.id).in_(pairs),
+                        tuple_(models.Pkg.source, models.Pkg.slug).in_(pairs))
         else:
-            return pkg.description
-
+            clauses += (and_(models.Pkg.source == s,
+                             or_(models.Pkg.id == n, models.Pkg.slug == n))
+                        for s, n in pairs)
     pkgs = (obj.m.db_session.query(models.Pkg)
-            .filter(or_(*(models.Pkg.slug.contains(d.name) if d.source == '*'
-                          else and_(models.Pkg.source == d.source,
-                                    or_(models.Pkg.id == d.name, models.Pkg.slug == d.name))
-                          for d in addons)))
+            .filter(or_(*clauses))
             .order_by(models.Pkg.source, models.Pkg.name)
             .all())
     if export:
         export_to_csv(pkgs, cast(Path, export))
     elif pkgs:
         if output_format == 'json':
-            from .models import MultiPkgModel
-
-            click.echo(MultiPkgModel.from_orm(pkgs).json(indent=2))
+            click.echo(models.MultiPkgModel.from_orm(pkgs).json(indent=2))
         elif output_format == 'detailed':
+            addon_dir = obj.m.config.addon_dir
+            get_pkg = obj.m.get
+
+            def format_deps(pkg: models.Pkg):
+                deps = (Defn(pkg.source, d.id) for d in pkg.deps)
+                return [str(d.with_name(getattr(get_pkg(d), 'slug', d.name))) for d in deps]
+
+            def get_desc(pkg: models.Pkg):
+                if pkg.source == 'wowi':
+                    toc_reader = TocReader.from_path_name(addon_dir / pkg.folders[0].name)
+                    return toc_reader['Notes'].value
+                else:
+                    return pkg.description
+
             formatter = click.HelpFormatter(max_width=99)
             for pkg in pkgs:
                 with formatter.section(pkg.to_defn()):
@@ -420,17 +456,21 @@ def list_(obj: M, addons: Sequence[Defn], export: Optional[str], output_format:
 @click.pass_obj
 def list_folders(obj: M, exclude_own: bool, toc_entries: Sequence[str]) -> None:
     "List add-on folders."
-    from .matchers import get_folders
+    from .matchers import AddonFolder, get_folders
+
+    def make_row(folder: AddonFolder):
+        toc_reader = folder.toc_reader
+        return (folder.name, *(toc_reader[e].value for e in toc_entries))
 
     folders = sorted(get_folders(obj.m, exclude_own=exclude_own))
     if folders:
-        rows = [('unreconciled' if exclude_own else 'folder', *(f'[{e}]' for e in toc_entries)),
-                *((f.name, *(f.toc_reader[e].value for e in toc_entries)) for f in folders)]
+        header = ('unreconciled' if exclude_own else 'folder', *(f'[{e}]' for e in toc_entries))
+        rows = [header, *map(make_row, folders)]
         click.echo(tabulate(rows))
 
 
 @main.command(hidden=True)
-@click.argument('addon', callback=_callbackify(partial(parse_into_defn, raise_invalid=False)))
+@click.argument('addon', callback=_callbackify(partial(_parse_one_defn, raise_invalid=False)))
 @click.pass_context
 def info(ctx: click.Context, addon: Defn) -> None:
     "Alias for `list -f detailed`."
@@ -438,7 +478,7 @@ def info(ctx: click.Context, addon: Defn) -> None:
 
 
 @main.command()
-@click.argument('addon', callback=_callbackify(partial(parse_into_defn, raise_invalid=False)))
+@click.argument('addon', callback=_callbackify(partial(_parse_one_defn, raise_invalid=False)))
 @click.pass_obj
 def visit(obj: M, addon: Defn) -> None:
     "Open an add-on's homepage in your browser."
@@ -451,7 +491,7 @@ def visit(obj: M, addon: Defn) -> None:
 
 
 @main.command()
-@click.argument('addon', callback=_callbackify(partial(parse_into_defn, raise_invalid=False)))
+@click.argument('addon', callback=_callbackify(partial(_parse_one_defn, raise_invalid=False)))
 @click.pass_obj
 def reveal(obj: M, addon: Defn) -> None:
     "Open an add-on folder in your file manager."
@@ -15,6 +15,14 @@ def _get_default_config_dir() -> Path:
     return Path(click.get_app_dir('instawow'))
 
 
+def _expand_path(value: Path) -> Path:
+    try:
+        return value.expanduser().resolve()
+    except RuntimeError as error:
+        # pathlib will raise RuntimeError for non-existent ~users
+        raise ValueError(str(error)) from error
+
+
 class BaseConfig(BaseSettings):
     def _build_values(self, init_kwargs: Dict[str, Any], _env_file: Any = None) -> Dict[str, Any]:
         # Prioritise env vars
@@ -32,24 +40,25 @@ class _Config(BaseConfig):
         env_prefix = 'INSTAWOW_'
         extra = Extra.allow
 
-    @validator('config_dir', 'addon_dir', 'temp_dir')
+    @validator('config_dir', 'temp_dir')
     def _expand_paths(cls, value: Path) -> Path:
-        try:
-            return value.expanduser().resolve()
-        except RuntimeError as error:
-            # pathlib will raise RuntimeError for non-existent ~users
-            raise ValueError(str(error)) from error
+        return _expand_path(value)
 
     @validator('addon_dir')
-    def _check_writable(cls, value: Path) -> Path:
+    def _expand_and_check_writable(cls, value: Path) -> Path:
+        value = _expand_path(value)
         if not (value.is_dir() and os.access(value, os.W_OK)):
             raise ValueError('must be a writable directory')
         return value
 
     @classmethod
     def read(cls) -> _Config:
-        dummy_config = cls(addon_dir='', game_flavour='retail')
-        return cls.parse_raw(dummy_config.config_file.read_text(encoding='utf-8'))
+        # Locate the config file without going through validation, mirroring
+        # the precedence of ``config_dir``: env var first, then the default
+        env_config_dir = os.environ.get(f'{cls.__config__.env_prefix}CONFIG_DIR')
+        config_dir = _expand_path(Path(env_config_dir) if env_config_dir
+                                  else _get_default_config_dir())
+        return cls.parse_raw((config_dir / 'config.json').read_text(encoding='utf-8'))
 
     def ensure_dirs(self) -> _Config:
         self.config_dir.mkdir(exist_ok=True, parents=True)
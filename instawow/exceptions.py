@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 from typing import TYPE_CHECKING, Awaitable, ClassVar, Optional, Sequence, Set
 
 from loguru import logger
@@ -10,11 +11,18 @@ if TYPE_CHECKING:
 
 
 class ManagerResult:
+    __slots__ = ()
+
     fmt_message: ClassVar[str]
+    _message: str
 
     @property
     def message(self) -> str:
-        return self.fmt_message.format(self=self)
+        try:
+            return self._message
+        except AttributeError:
+            message = self._message = self.fmt_message.format(self=self)
+            return message
 
     @staticmethod
     async def acapture(awaitable: Awaitable[ManagerResult]) -> ManagerResult:
@@ -23,12 +31,18 @@ class ManagerResult:
             return await awaitable
         except ManagerError as error:
             return error
+        except asyncio.CancelledError:
+            # ``CancelledError`` derives from ``Exception`` prior to Python 3.8
+            # and cancellation must not be swallowed
+            raise
         except Exception as error:
             logger.exception('error!')
             return InternalError(error)
 
 
 class PkgInstalled(ManagerResult):
+    __slots__ = ('new_pkg', '_message')
+
     fmt_message = 'installed {self.new_pkg.version}'
 
     def __init__(self, new_pkg: Pkg) -> None:
@@ -37,6 +51,8 @@ class PkgInstalled(ManagerResult):
 
 
 class PkgUpdated(ManagerResult):
+    __slots__ = ('old_pkg', 'new_pkg', '_message')
+
     fmt_message = 'updated {self.old_pkg.version} to {self.new_pkg.version}'
 
     def __init__(self, old_pkg: Pkg, new_pkg: Pkg) -> None:
@@ -46,6 +62,8 @@ class PkgUpdated(ManagerResult):
 
 
 class PkgRemoved(ManagerResult):
+    __slots__ = ('old_pkg', '_message')
+
     fmt_message = 'removed'
 
     def __init__(self, old_pkg: Pkg) -> None:
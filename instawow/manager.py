@@ -1,20 +1,24 @@
 from __future__ import annotations
 
 import asyncio
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager, nullcontext
 import contextvars as cv
 from functools import partial
 from itertools import filterfalse, starmap
 import json
+import os
 from pathlib import Path, PurePath
 import posixpath
-from shutil import copy, move
+import re
+from shutil import copy, copyfileobj, move
 from tempfile import NamedTemporaryFile, mkdtemp
 from typing import (TYPE_CHECKING, Any, AsyncContextManager as ACM, AsyncIterator, Awaitable,
-                    Callable, Dict, Iterable, List, Mapping, NoReturn, Optional as O, Sequence,
-                    Set, Tuple, TypeVar, Union, cast)
+                    Callable, Dict, Iterable, Iterator, List, Mapping, NoReturn, Optional as O,
+                    Sequence, Set, Tuple, TypeVar, Union, cast)
+from weakref import WeakKeyDictionary
 
 from loguru import logger
+from yarl import URL
 
 from . import DB_REVISION, exceptions as E
 from .models import Pkg, PkgFolder, is_pkg
@@ -31,14 +35,18 @@ if TYPE_CHECKING:
 
     _T = TypeVar('_T')
     _ArchiveR = Tuple[List[str], Callable[[Path], Awaitable[None]]]
+    _Consumable = Union[E.ManagerResult, Callable[..., Awaitable[E.ManagerResult]]]
 
 
 USER_AGENT = 'instawow (https://github.com/layday/instawow)'
 
 _web_client: cv.ContextVar[aiohttp.ClientSession] = cv.ContextVar('_web_client')
+_progress_bar: cv.ContextVar[ProgressBar] = cv.ContextVar('_progress_bar')
+# Stand-in for the progress tracker which is placed in the trace context
+# of requests whose progress is shown
+_no_progress = nullcontext(lambda count: None)
 
 AsyncNamedTemporaryFile = t(NamedTemporaryFile)
-amkdtemp = t(mkdtemp)
 acopy = t(copy)
 amove = t(move)
 
@@ -58,22 +66,35 @@ async def open_temp_writer() -> AsyncIterator[Tuple[Path, Callable]]:
 
 
 async def trash(paths: Sequence[Path], parent: PurePath, *, missing_ok: bool = False) -> None:
-    dst = await amkdtemp(dir=parent, prefix='deleted-' + paths[0].name + '-')
-    for path in map(str, paths):    # https://bugs.python.org/issue32689
-        try:
-            await amove(path, dst)
-        except (FileNotFoundError if missing_ok else ()):
-            logger.opt(exception=True).info('source missing')
+    # Move everything over in one go to avoid a thread round trip per path
+    def move_all() -> None:
+        dst = mkdtemp(dir=parent, prefix='deleted-' + paths[0].name + '-')
+        for path in map(str, paths):    # https://bugs.python.org/issue32689
+            try:
+                move(path, dst)
+            except (FileNotFoundError if missing_ok else ()):
+                logger.opt(exception=True).info('source missing')
+
+    await t(move_all)()
 
 
 # macOS 'resource forks' are sometimes included in download zips - these
 # violate our one add-on per folder contract-thing and will be omitted
 _zip_excludes = {'__MACOSX'}
 
+_copy_buffer_size = 2 ** 20
+_windows_illegal_name_table = str.maketrans(':<>|"?*', '_' * 7)
+# Local archives smaller than this are copied without handing off to a thread
+_inline_copy_max_size = 2 ** 20
+# Response bodies are read in chunks of this size when downloading
+_response_chunk_size = 2 ** 16
+
 
 def find_base_dirs(names: Sequence[str]) -> Set[str]:
-    return {n for n in (posixpath.dirname(n) for n in names)
-            if n and posixpath.sep not in n} - _zip_excludes
+    # The first component of any name which has a separator in it is a folder,
+    # mirroring ``should_extract``
+    return {h for h, s, _ in (n.partition(posixpath.sep) for n in names)
+            if h and s} - _zip_excludes
 
 
 def should_extract(base_dirs: Set[str]) -> Callable[[str], bool]:
@@ -84,17 +105,42 @@ def should_extract(base_dirs: Set[str]) -> Callable[[str], bool]:
     return is_member
 
 
+def make_member_path(parent: Path, name: str) -> Path:
+    # Sanitise member names the same way ``ZipFile.extract`` does, discarding
+    # drive letters, the root and any '.' or '..' components
+    _, name = os.path.splitdrive(name.replace(posixpath.sep, os.sep))
+    parts: Iterable[str] = (p for p in name.split(os.sep)
+                            if p not in {'', os.curdir, os.pardir})
+    if os.sep == '\\':
+        # On Windows, characters which are illegal in file names are replaced
+        # and trailing dots are stripped
+        parts = filter(None, (p.translate(_windows_illegal_name_table).rstrip('.')
+                              for p in parts))
+    return parent.joinpath(*parts)
+
+
 @asynccontextmanager
 async def acquire_archive(path: PurePath) -> AsyncIterator[_ArchiveR]:
     from zipfile import ZipFile
 
     def extract(parent: Path) -> None:
-        conflicts = base_dirs & {f.name for f in parent.iterdir()}
+        # Probe for each of the archive's folders instead of listing
+        # the contents of the entire add-on directory
+        conflicts = {d for d in base_dirs if os.path.lexists(parent / d)}
         if conflicts:
             raise E.PkgConflictsWithForeign(conflicts)
         else:
-            members = filter(should_extract(base_dirs), names)
-            archive.extractall(parent, members=members)
+            is_member = should_extract(base_dirs)
+            members = [(i, make_member_path(parent, i.filename))
+                       for i in archive.infolist() if is_member(i.filename)]
+            # Create all of the directories in one go instead of
+            # checking for the parent of every member
+            for dir_ in {p if i.is_dir() else p.parent for i, p in members}:
+                dir_.mkdir(parents=True, exist_ok=True)
+            for info, member_path in members:
+                if not info.is_dir():
+                    with archive.open(info) as src, member_path.open('wb') as dst:
+                        copyfileobj(src, dst, _copy_buffer_size)
 
     archive = await t(ZipFile)(path)
     try:
@@ -105,7 +151,24 @@ async def acquire_archive(path: PurePath) -> AsyncIterator[_ArchiveR]:
         await t(archive.close)()
 
 
-async def download_archive(manager: Manager, pkg: Pkg, *, chunk_size: int = 4096) -> ACM[_ArchiveR]:
+# Downloads are capped per host to stay clear of rate limiting.
+# Semaphores are bound to the loop they're created in (prior to Python 3.10)
+# and every ``CliManager`` runs its own loop, so they're keyed by loop
+_max_downloads_per_host = 5
+_download_semaphores: WeakKeyDictionary[Any, Dict[str, asyncio.Semaphore]] = WeakKeyDictionary()
+
+
+def _get_download_semaphore(url: str) -> asyncio.Semaphore:
+    semaphores = _download_semaphores.setdefault(asyncio.get_running_loop(), {})
+    host = cast(str, URL(url).host)
+    semaphore = semaphores.get(host)
+    if semaphore is None:
+        semaphore = semaphores[host] = asyncio.Semaphore(_max_downloads_per_host)
+    return semaphore
+
+
+async def download_archive(manager: Manager, pkg: Pkg,
+                           *, chunk_size: int = _response_chunk_size) -> ACM[_ArchiveR]:
     url = pkg.download_url
     dst = manager.config.cache_dir / shasum(pkg.source, pkg.id, pkg.file_id)
 
@@ -114,13 +177,22 @@ async def download_archive(manager: Manager, pkg: Pkg, *, chunk_size: int = 4096
     elif url.startswith('file://'):
         from urllib.parse import unquote
 
-        await acopy(unquote(url[7:]), dst)
+        src = unquote(url[7:])
+        # Handing small files off to a thread costs more than copying them
+        if os.path.getsize(src) < _inline_copy_max_size:
+            copy(src, dst)
+        else:
+            await acopy(src, dst)
     else:
-        kwargs = {'raise_for_status': True, 'trace_request_ctx': {'show_progress': True}}
-        async with manager.web_client.get(url, **kwargs) as response, \
+        trace_ctx: Dict[str, Any] = {'show_progress': True}
+        async with _get_download_semaphore(url), \
+                manager.web_client.get(url, raise_for_status=True,
+                                       trace_request_ctx=trace_ctx) as response, \
                 open_temp_writer() as (temp_path, write):
-            async for chunk in response.content.iter_chunked(chunk_size):
-                await write(chunk)
+            with trace_ctx.get('progress', _no_progress) as advance:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    await write(chunk)
+                    advance(len(chunk))
 
         await amove(temp_path, dst)
     return acquire_archive(dst)
@@ -130,20 +202,24 @@ async def cache_json_response(manager: Manager, url: str, *args: Any, label: O[s
     dst = manager.config.cache_dir / shasum(url)
 
     if await t(is_not_stale)(dst, *args):
-        text = await t(dst.read_text)(encoding='utf-8')
+        content = await t(dst.read_bytes)()
     else:
-        kwargs: Dict[str, Any] = {'raise_for_status': True}
-        if label:
-            kwargs.update({'trace_request_ctx': {'show_progress': True, 'label': label}})
-        async with manager.web_client.get(url, **kwargs) as response:
-            text = await response.text()
+        trace_ctx: Dict[str, Any] = {'show_progress': bool(label), 'label': label}
+        async with manager.web_client.get(url, raise_for_status=True,
+                                          trace_request_ctx=trace_ctx) as response:
+            chunks = []
+            with trace_ctx.get('progress', _no_progress) as advance:
+                async for chunk in response.content.iter_chunked(_response_chunk_size):
+                    chunks.append(chunk)
+                    advance(len(chunk))
+            content = b''.join(chunks)
 
-        await t(dst.write_text)(text, encoding='utf-8')
-    return json.loads(text)
+        await t(dst.write_bytes)(content)
+    return json.loads(content)
 
 
 def prepare_db_session(config: Config) -> scoped_session:
-    from sqlalchemy import create_engine
+    from sqlalchemy import create_engine, event
     from sqlalchemy.orm import sessionmaker, scoped_session
     from .models import ModelBase, should_migrate
 
@@ -155,6 +231,24 @@ def prepare_db_session(config: Config) -> scoped_session:
     db_exists = db_path.exists()
 
     engine = create_engine(db_url)
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+        # pysqlite's own transaction handling breaks savepoints, so we'll
+        # be starting transactions ourselves (see ``begin_transaction``)
+        dbapi_connection.isolation_level = None
+        # With write-ahead logging and ``synchronous`` set to 'NORMAL'
+        # commits no longer wait on an fsync of the main database file
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode = WAL')
+        cursor.execute('PRAGMA synchronous = NORMAL')
+        cursor.execute('PRAGMA temp_store = MEMORY')
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def begin_transaction(connection: Any) -> None:
+        connection.execute('BEGIN')
+
     if should_migrate(engine, DB_REVISION):
         from alembic.command import stamp, upgrade
         from alembic.config import Config as AConfig
@@ -181,7 +275,10 @@ def prepare_db_session(config: Config) -> scoped_session:
 def init_web_client(**kwargs: Any) -> aiohttp.ClientSession:
     from aiohttp import ClientSession, ClientTimeout, TCPConnector
 
-    kwargs = {'connector': TCPConnector(force_close=True, limit_per_host=10),
+    # Reuse connections across requests to the same host so that downloads
+    # in a batch don't each pay for a fresh TCP and TLS handshake
+    connector = TCPConnector(limit_per_host=10, keepalive_timeout=75, ttl_dns_cache=300)
+    kwargs = {'connector': connector,
               'headers': {'User-Agent': USER_AGENT},
               'trust_env': True,    # Respect http_proxy env var
               'timeout': cast(Any, ClientTimeout)(connect=15),
@@ -198,11 +295,6 @@ class _DummyResolver:
         return dict.fromkeys(defns, E.PkgSourceInvalid())
 
 
-class _ResolverDict(dict):
-    def __missing__(self, key: str) -> Resolver:
-        return _DummyResolver
-
-
 async def _error_out(error: Union[E.ManagerError, E.InternalError]) -> NoReturn:
     raise error
 
@@ -218,7 +310,7 @@ class Manager:
         self.db_session = db_session
 
         resolvers = (CurseResolver, WowiResolver, TukuiResolver, InstawowResolver)
-        self.resolvers = _ResolverDict({r.source: r(self) for r in resolvers})
+        self.resolvers = {r.source: r(self) for r in resolvers}
         self.catalogue = None      # type: ignore
 
     @property
@@ -231,9 +323,11 @@ class Manager:
 
     def get(self, defn: Defn) -> O[Pkg]:
         "Get a package from (source, id) or (source, slug)."
-        return (self.db_session.query(Pkg)
-                .filter(Pkg.source == defn.source,
-                        (Pkg.id == defn.name) | (Pkg.slug == defn.name)).first())
+        # Try the primary key first, which won't hit the database
+        # if the package is already in the session's identity map
+        return (self.db_session.query(Pkg).get((defn.source, defn.name))
+                or (self.db_session.query(Pkg)
+                    .filter(Pkg.source == defn.source, Pkg.slug == defn.name).first()))
 
     def get_from_substr(self, defn: Defn) -> O[Pkg]:
         "Get a package from a partial slug."
@@ -257,9 +351,34 @@ class Manager:
             catalogue = await cache_json_response(self, url, 4, 'hours', label=label)
             self.catalogue = MasterCatalogue.parse_obj(catalogue)
 
-    async def _consume_seq(self, coros_by_defn: Dict[Defn, Callable[..., Awaitable[Any]]]
+    async def _consume_seq(self, coros_by_defn: Dict[Defn, _Consumable]
                            ) -> Dict[Defn, E.ManagerResult]:
-        return {d: await E.ManagerResult.acapture(c()) for d, c in coros_by_defn.items()}
+        # Each package is processed inside of a savepoint which is rolled back
+        # if the package fails, and the batch is committed together at the end
+        results = {}
+        try:
+            for defn, coro_fn in coros_by_defn.items():
+                # Results which are known in advance are passed through as they are
+                # rather than being raised from a coroutine only to be captured again
+                if isinstance(coro_fn, E.ManagerResult):
+                    results[defn] = coro_fn
+                    continue
+
+                self.db_session.begin_nested()
+                result = results[defn] = await E.ManagerResult.acapture(coro_fn())
+                if isinstance(result, (E.ManagerError, E.InternalError)):
+                    self.db_session.rollback()
+                else:
+                    self.db_session.commit()
+        except BaseException:
+            # Hold on to packages which have already been processed
+            # on interruption, whose folders will have been extracted
+            if len(results) < len(coros_by_defn):
+                self.db_session.rollback()
+            self.db_session.commit()
+            raise
+        self.db_session.commit()
+        return results
 
     async def _resolve_deps(self, results: Iterable[Any]) -> Dict[Defn, Any]:
         """Resolve package dependencies.
@@ -288,7 +407,8 @@ class Manager:
         await self.synchronise()
         defns_by_source = bucketise(defns, key=lambda v: v.source)
 
-        results = await gather(self.resolvers[s].resolve(b)
+        # Definitions with an unknown source are handed off to the dummy resolver
+        results = await gather(self.resolvers.get(s, _DummyResolver).resolve(b)
                                for s, b in defns_by_source.items())
         results_by_defn = dict_chain(defns, None, *(r.items() for r in results))
         if with_deps:
@@ -339,7 +459,7 @@ class Manager:
 
         pkg.folders = [PkgFolder(name=f) for f in folders]
         self.db_session.add(pkg)
-        self.db_session.commit()
+        self.db_session.flush()
         return E.PkgInstalled(pkg)
 
     async def install(self, defns: Sequence[Defn], replace: bool) -> Dict[Defn, E.ManagerResult]:
@@ -353,17 +473,19 @@ class Manager:
         archives = await gather(installables.values())
 
         coros = dict_chain(
-            defns, partial(_error_out, E.PkgAlreadyInstalled()),
+            defns, E.PkgAlreadyInstalled(),
             ((d, partial(_error_out, r)) for d, r in results.items()),
             ((d, partial(self.install_one, p, a, replace))
              for (d, p), a in zip(installables, archives)))
         return await self._consume_seq(coros)
 
     async def update_one(self, old_pkg: Pkg, pkg: Pkg, archive: ACM[_ArchiveR]) -> E.PkgUpdated:
+        from sqlalchemy import and_
+
         async with archive as (folders, extract):
             conflicts = (
                 self.db_session.query(Pkg).join(Pkg.folders)
-                .filter(PkgFolder.pkg_source != pkg.source, PkgFolder.pkg_id != pkg.id)
+                .filter(~and_(PkgFolder.pkg_source == pkg.source, PkgFolder.pkg_id == pkg.id))
                 .filter(PkgFolder.name.in_(folders)).all())
             if conflicts:
                 raise E.PkgConflictsWithInstalled(conflicts)
@@ -373,7 +495,7 @@ class Manager:
 
         pkg.folders = [PkgFolder(name=f) for f in folders]
         self.db_session.add(pkg)
-        self.db_session.commit()
+        self.db_session.flush()
         return E.PkgUpdated(old_pkg, pkg)
 
     async def update(self, defns: Sequence[Defn]) -> Dict[Defn, E.ManagerResult]:
@@ -391,9 +513,9 @@ class Manager:
         archives = await gather(updatables.values())
 
         coros = dict_chain(
-            checked_defns, partial(_error_out, E.PkgNotInstalled()),
+            checked_defns, E.PkgNotInstalled(),
             ((d, partial(_error_out, r)) for d, r in results.items()),
-            ((d, partial(_error_out, E.PkgUpToDate())) for d in installables),
+            ((d, E.PkgUpToDate()) for d in installables),
             ((d, partial(self.update_one, *p, a))
              for (d, *p), a in zip(updatables, archives)))
         return await self._consume_seq(coros)
@@ -402,72 +524,78 @@ class Manager:
         await trash([self.config.addon_dir / f.name for f in pkg.folders],  # type: ignore  # ^sqla
                     parent=self.config.temp_dir, missing_ok=True)
         self.db_session.delete(pkg)
-        self.db_session.commit()
+        self.db_session.flush()
         return E.PkgRemoved(pkg)
 
     async def remove(self, defns: Sequence[Defn]) -> Dict[Defn, E.ManagerResult]:
         pkgs_by_defn = ((d, self.get(d)) for d in defns)
         coros = dict_chain(
-            defns, partial(_error_out, E.PkgNotInstalled()),
+            defns, E.PkgNotInstalled(),
             ((d, partial(self.remove_one, p)) for d, p in pkgs_by_defn if p))
         return await self._consume_seq(coros)
 
 
-_tick_interval = .1
-_tickers: cv.ContextVar[Set[asyncio.Task[None]]] = cv.ContextVar('_tickers', default=set())
+# Matches parameters in a ``Content-Disposition``-like header, consuming quoted values
+# whole so that semicolons in quotes aren't mistaken for parameter boundaries
+_header_param_pattern = re.compile(r';\s*([^\s=;]+)\s*=\s*("(?:\\.|[^"\\])*"|[^;]*)')
 
 
-@asynccontextmanager
-async def cancel_tickers() -> AsyncIterator[None]:
-    try:
-        yield
-    finally:
-        for ticker in _tickers.get():
-            ticker.cancel()
+def extract_filename(response: aiohttp.ClientResponse) -> str:
+    "Extract the filename from the ``Content-Disposition`` header, falling back on the URL."
+    from aiohttp import hdrs
 
+    filename = None
+    content_disposition = response.headers.get(hdrs.CONTENT_DISPOSITION, '')
+    for name, value in _header_param_pattern.findall(content_disposition):
+        if name.lower() == 'filename':
+            # Unquote the value the same way ``cgi.parse_header`` does
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] == '"':
+                value = value[1:-1].replace('\\\\', '\\').replace('\\"', '"')
+            filename = value
+    return filename or response.url.name
 
-def init_cli_web_client(*, Bar: ProgressBar) -> aiohttp.ClientSession:
-    from cgi import parse_header
-    from aiohttp import TraceConfig, hdrs
 
-    def extract_filename(response: aiohttp.ClientResponse) -> str:
-        _, cd_params = parse_header(response.headers.get(hdrs.CONTENT_DISPOSITION, ''))
-        filename = cd_params.get('filename') or response.url.name
-        return filename
+def init_cli_web_client() -> aiohttp.ClientSession:
+    from aiohttp import TraceConfig, hdrs
 
     async def do_on_request_end(session: Any, request_ctx: Any, params: Any) -> None:   # ^aiohttp
         ctx = request_ctx.trace_request_ctx
         if not (ctx and ctx.get('show_progress')):
             return
 
-        async def ticker() -> None:
-            label = ctx.get('label') or f'Downloading {extract_filename(params.response)}'
-            total = params.response.content_length
-            if (total is None
-                    # Size before decoding is not exposed in streaming API and
-                    # `Content-Length` has the size of the payload after gzipping
-                    or params.response.headers.get(hdrs.CONTENT_ENCODING) == 'gzip'):
-                # Length of zero will have a hash sign cycle through the bar
-                # (see indeterminate progress bars)
-                total = 0
-
-            bar = None
+        # The client outlives any one progress bar, which is swapped out between runs
+        Bar = _progress_bar.get()
+        label = ctx.get('label') or f'Downloading {extract_filename(params.response)}'
+        total = params.response.content_length
+        if (total is None
+                # Size before decoding is not exposed in streaming API and
+                # `Content-Length` has the size of the payload after gzipping
+                or params.response.headers.get(hdrs.CONTENT_ENCODING) == 'gzip'):
+            # Length of zero will have a hash sign cycle through the bar
+            # (see indeterminate progress bars)
+            total = 0
+
+        @contextmanager
+        def track_progress() -> Iterator[Callable[[int], None]]:
+            bar = Bar(label=label, total=total)
+            completed = 0
+
+            def advance(count: int) -> None:
+                nonlocal completed
+                completed += count
+                # This is ``bar.current`` in prompt_toolkit v2
+                # and ``.items_completed`` in v3
+                bar.current = bar.items_completed = completed
+                Bar.invalidate()
+
             try:
-                bar = Bar(label=label, total=total)
-                content = params.response.content
-
-                while not content.is_eof():
-                    # This is ``bar.current`` in prompt_toolkit v2
-                    # and ``.items_completed`` in v3
-                    bar.current = bar.items_completed = content.total_bytes
-                    Bar.invalidate()
-                    await asyncio.sleep(_tick_interval)
+                yield advance
             finally:
-                if bar is not None:
-                    Bar.counters.remove(bar)
+                Bar.counters.remove(bar)
 
-        tickers = _tickers.get()
-        tickers.add(asyncio.create_task(ticker()))
+        # The bar is advanced by the reader as chunks are consumed
+        ctx['progress'] = track_progress()
 
     trace_config = TraceConfig()
     trace_config.on_request_end.append(do_on_request_end)
@@ -476,15 +604,36 @@ def init_cli_web_client(*, Bar: ProgressBar) -> aiohttp.ClientSession:
 
 
 class CliManager(Manager):
+    def __init__(self, config: Config, db_session: scoped_session) -> None:
+        super().__init__(config, db_session)
+        self._loop: O[asyncio.AbstractEventLoop] = None
+
     def run(self, awaitable: Awaitable[_T]) -> _T:
-        async def run():
-            async with init_cli_web_client(Bar=Bar) as self.web_client, \
-                    cancel_tickers():
-                return await awaitable
+        # The loop and the web client are reused across runs
+        # so that connections are kept alive between them
+        if self._loop is None:
+            async def open_web_client() -> aiohttp.ClientSession:
+                return init_cli_web_client()
+
+            self._loop = asyncio.new_event_loop()
+            self.web_client = self._loop.run_until_complete(open_web_client())
 
         with make_progress_bar() as Bar:
-            loop = asyncio.new_event_loop()
+            _progress_bar.set(Bar)
+            return self._loop.run_until_complete(awaitable)
+
+    def close(self) -> None:
+        "Close the web client and the loop if they've been opened."
+        if self._loop is not None:
             try:
-                return loop.run_until_complete(run())
+                # Tasks left pending by an interrupted run would otherwise
+                # be resumed when the web client is closed
+                tasks = asyncio.all_tasks(self._loop)
+                if tasks:
+                    for task in tasks:
+                        task.cancel()
+                    self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+                self._loop.run_until_complete(self.web_client.close())
             finally:
-                loop.close()
+                self._loop.close()
+                self._loop = None
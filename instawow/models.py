@@ -8,7 +8,7 @@ import sqlalchemy.exc
 from sqlalchemy.ext.declarative import DeclarativeMeta, as_declarative
 from sqlalchemy.inspection import inspect
 from sqlalchemy.orm import relationship
-from sqlalchemy.schema import Column, ForeignKeyConstraint, MetaData, UniqueConstraint
+from sqlalchemy.schema import Column, ForeignKeyConstraint, Index, MetaData, UniqueConstraint
 from sqlalchemy.types import DateTime, Integer, String
 
 if TYPE_CHECKING:
@@ -60,6 +60,7 @@ ModelBase = _BaseTable
 
 class Pkg(_BaseTable):
     __tablename__ = 'pkg'
+    __table_args__ = (Index('ix_pkg_source_slug', 'source', 'slug'),)
 
     source = Column(String, primary_key=True)
     id = Column(String, primary_key=True)
@@ -285,6 +285,17 @@ def test_substr_list_match(molinari_and_run):
     assert (molinari['source'], molinari['slug']) == ('curse', 'molinari')
 
 
+@pytest.mark.parametrize('sqlite_version_info', [None, (3, 14, 0)])
+def test_exact_list_match(molinari_and_run, monkeypatch, sqlite_version_info):
+    if sqlite_version_info:
+        # Without support for row values
+        monkeypatch.setattr('sqlite3.sqlite_version_info', sqlite_version_info)
+    assert molinari_and_run('list curse:molinari').output == 'curse:molinari\n'
+    assert molinari_and_run('list curse:20338').output == 'curse:molinari\n'
+    assert molinari_and_run('list curse:molinari wowi:molinari').output == 'curse:molinari\n'
+    assert molinari_and_run('list wowi:molinari').output == ''
+
+
 def test_csv_export_and_import(molinari_and_run, manager):
     export_csv = manager.config._parametrized_tmp_path / 'export.csv'
     molinari_and_run(f'list -e "{export_csv}"')
@@ -297,3 +308,11 @@ curse:molinari,default
 ✗ curse:molinari
   package already installed
 '''
+
+
+def test_list_folders_with_toc_entries(molinari_and_run):
+    assert molinari_and_run('list-folders -t Title').output == '''\
+ folder  [Title]
+-------- -------
+Molinari        \n\
+'''
@@ -27,6 +27,14 @@ def test_reading_missing_config_from_env_raises(full_config, monkeypatch):
         Config.read()
 
 
+def test_reading_config_from_env(full_config, monkeypatch):
+    monkeypatch.setenv('INSTAWOW_CONFIG_DIR', str(full_config['config_dir']))
+    Config(**full_config).write()
+    config = Config.read()
+    assert config.addon_dir == full_config['addon_dir'].resolve()
+    assert config.game_flavour == full_config['game_flavour']
+
+
 @pytest.mark.skipif(sys.platform == 'win32', reason='no ~ expansion on Windows')
 @pytest.mark.parametrize('dir_', ['config_dir', 'addon_dir', 'temp_dir'])
 def test_invalid_any_dir_raises(full_config, dir_):
@@ -0,0 +1,210 @@
+import asyncio
+from contextlib import nullcontext
+from datetime import datetime
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import click
+import pytest
+
+from instawow.cli import ManagerWrapper, main
+from instawow.config import Config
+import instawow.exceptions as E
+from instawow.manager import (CliManager, _progress_bar, cache_json_response, download_archive,
+                              init_cli_web_client, prepare_db_session)
+from instawow.models import Pkg, PkgDep, PkgOptions
+from instawow.resolvers import Defn
+
+
+def make_pkg(id, deps=()):
+    return Pkg(source='curse', id=id, slug=id, name=id, description='', url='', file_id='1',
+               download_url='', date_published=datetime.now(), version='1',
+               options=PkgOptions(strategy='default'), deps=[PkgDep(id=d) for d in deps])
+
+
+@pytest.mark.asyncio
+async def test_pkg_failing_to_flush_does_not_affect_rest_of_batch(manager):
+    def install(pkg):
+        async def install():
+            manager.db_session.add(pkg)
+            manager.db_session.flush()
+            return E.PkgInstalled(pkg)
+
+        return install
+
+    results = await manager._consume_seq({Defn('curse', '1'): install(make_pkg('1')),
+                                          # Violates the dep unique constraint
+                                          Defn('curse', '2'): install(make_pkg('2', ['d', 'd'])),
+                                          Defn('curse', '3'): install(make_pkg('3'))})
+    assert [type(r) for r in results.values()] == [E.PkgInstalled, E.InternalError, E.PkgInstalled]
+    manager.db_session.expire_all()
+    assert [p.id for p in manager.db_session.query(Pkg).order_by(Pkg.id)] == ['1', '3']
+
+
+@pytest.mark.asyncio
+async def test_cancelled_batch_does_not_process_remaining_pkgs(manager):
+    processed = []
+    blocking = asyncio.Event()
+
+    def install(pkg, block=False):
+        async def install():
+            processed.append(pkg.id)
+            manager.db_session.add(pkg)
+            manager.db_session.flush()
+            if block:
+                blocking.set()
+                await asyncio.Event().wait()
+            return E.PkgInstalled(pkg)
+
+        return install
+
+    task = asyncio.create_task(
+        manager._consume_seq({Defn('curse', '1'): install(make_pkg('1')),
+                              Defn('curse', '2'): install(make_pkg('2'), block=True),
+                              Defn('curse', '3'): install(make_pkg('3'))}))
+    await blocking.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert processed == ['1', '2']
+    manager.db_session.expire_all()
+    assert [p.id for p in manager.db_session.query(Pkg)] == ['1']
+
+
+@pytest.fixture
+def cli_manager(full_config):
+    config = Config(**full_config).write()
+    manager = CliManager(config, prepare_db_session(config=config))
+    with patch('instawow.manager.make_progress_bar', lambda: nullcontext(None)):
+        yield manager
+    manager.close()
+
+
+def test_cli_manager_reuses_web_client_across_runs(cli_manager):
+    async def get_web_client():
+        return cli_manager.web_client
+
+    web_client = cli_manager.run(get_web_client())
+    assert cli_manager.run(get_web_client()) is web_client
+    cli_manager.close()
+    assert web_client.closed
+    assert cli_manager._loop is None
+
+
+def test_cli_manager_close_cancels_pending_tasks(cli_manager):
+    steps = []
+
+    async def step():
+        await asyncio.sleep(.1)
+        steps.append(...)
+
+    async def start_step():
+        return asyncio.create_task(step())
+
+    task = cli_manager.run(start_step())
+    cli_manager.close()
+    assert task.cancelled()
+    assert not steps
+
+
+def test_cli_manager_is_closed_with_click_context(full_config, monkeypatch):
+    monkeypatch.setenv('INSTAWOW_CONFIG_DIR', str(full_config['config_dir']))
+    Config(**full_config).write()
+
+    with patch('instawow.manager.make_progress_bar', lambda: nullcontext(None)), \
+            click.Context(main):
+        manager = ManagerWrapper().m
+        manager.run(asyncio.sleep(0))
+        assert manager._loop is not None
+    assert manager._loop is None
+
+
+@pytest.mark.asyncio
+async def test_update_conflicting_with_pkg_from_same_source_raises(manager):
+    molinari_defn = Defn('curse', 'molinari')
+    await manager.install([molinari_defn], replace=False)
+    molinari = manager.get(molinari_defn)
+    # Hand Molinari's folder over to another curse package
+    # and have Molinari behind by one version
+    other = make_pkg('other')
+    other.folders = molinari.folders
+    manager.db_session.add(other)
+    molinari.file_id = '0'
+    manager.db_session.commit()
+
+    results = await manager.update([molinari_defn])
+    assert isinstance(results[molinari_defn], E.PkgConflictsWithInstalled)
+
+
+class FakeProgressBar:
+    def __init__(self):
+        self.counters = []
+        self.created = []
+
+    def __call__(self, label, total):
+        counter = SimpleNamespace(label=label, total=total, items_completed=0)
+        self.counters.append(counter)
+        self.created.append(counter)
+        return counter
+
+    def invalidate(self):
+        pass
+
+
+@pytest.fixture
+def progress_bar():
+    bar = FakeProgressBar()
+    token = _progress_bar.set(bar)
+    yield bar
+    _progress_bar.reset(token)
+
+
+@pytest.mark.asyncio
+async def test_download_progress_is_advanced_by_reader(aresponses, manager, progress_bar):
+    # Downloads are cached in the temp dir, which is shared between flavours
+    pkg = make_pkg(f'foo-{manager.config.game_flavour}')
+    pkg.download_url = 'https://example.com/foo.zip'
+    content = b'0' * 2 ** 17
+    aresponses.add('example.com', '/foo.zip', 'get', aresponses.Response(body=content))
+
+    async with init_cli_web_client() as manager.web_client:
+        await download_archive(manager, pkg)
+
+    counter, = progress_bar.created
+    assert (counter.label, counter.total) == ('Downloading foo.zip', len(content))
+    assert counter.items_completed == len(content)
+    assert not progress_bar.counters
+
+
+@pytest.mark.asyncio
+async def test_catalogue_progress_is_advanced_by_reader(aresponses, manager, progress_bar):
+    # Responses are cached by URL
+    path = f'/{manager.config.game_flavour}/foo.json'
+    content = json.dumps({'foo': 'bar'}).encode()
+    aresponses.add('example.com', path, 'get', aresponses.Response(body=content))
+
+    async with init_cli_web_client() as manager.web_client:
+        result = await cache_json_response(manager, f'https://example.com{path}',
+                                           4, 'hours', label='Foo')
+
+    assert result == {'foo': 'bar'}
+    counter, = progress_bar.created
+    assert (counter.label, counter.items_completed) == ('Foo', len(content))
+    assert not progress_bar.counters
+
+
+@pytest.mark.asyncio
+async def test_progress_bar_is_removed_on_error(aresponses, progress_bar):
+    aresponses.add('example.com', '/foo.zip', 'get', aresponses.Response(body=b'0'))
+
+    trace_ctx = {'show_progress': True}
+    async with init_cli_web_client() as web_client, \
+            web_client.get('https://example.com/foo.zip', trace_request_ctx=trace_ctx):
+        with pytest.raises(ValueError), \
+                trace_ctx['progress'] as advance:
+            advance(1)
+            raise ValueError
+
+    assert len(progress_bar.created) == 1
+    assert not progress_bar.counters
@@ -1,8 +1,12 @@
 from pathlib import Path
+import sys
+from types import SimpleNamespace
 
+from multidict import CIMultiDict
 import pytest
+from yarl import URL
 
-from instawow.manager import find_base_dirs, should_extract
+from instawow.manager import extract_filename, find_base_dirs, make_member_path, should_extract
 from instawow.utils import TocReader, bucketise, merge_intersecting_sets, tabulate
 
 
@@ -19,6 +23,10 @@ def test_find_base_dirs_can_find_implicit_dirs():
     assert find_base_dirs(['b/b.toc']) == {'b'}
 
 
+def test_find_base_dirs_can_find_dirs_of_nested_members():
+    assert find_base_dirs(['b/c/c.toc']) == {'b'}
+
+
 def test_find_base_dirs_discards_resource_forks():
     assert find_base_dirs(['b/', '__MACOSX/']) == {'b'}
 
@@ -32,6 +40,31 @@ def test_should_extract_discards_names_with_prefix_not_in_dirs():
     assert list(map(is_member, ['a/', 'b/', 'aa/', 'bb/'])) == [False, True, False, False]
 
 
+def test_make_member_path_discards_unsafe_parts(tmp_path):
+    assert make_member_path(tmp_path, 'b/b.toc') == tmp_path / 'b' / 'b.toc'
+    assert make_member_path(tmp_path, '/b/../b.toc') == tmp_path / 'b' / 'b.toc'
+    assert make_member_path(tmp_path, './b/') == tmp_path / 'b'
+    if sys.platform == 'win32':
+        assert make_member_path(tmp_path, 'b<?/b..toc.') == tmp_path / 'b__' / 'b..toc'
+        assert make_member_path(tmp_path, 'b/.../b.toc') == tmp_path / 'b' / 'b.toc'
+
+
+@pytest.mark.parametrize('content_disposition, filename', [
+    ('attachment; filename="foo bar.zip"', 'foo bar.zip'),
+    ('attachment; filename="foo \\"bar\\".zip"', 'foo "bar".zip'),
+    ('attachment; filename=foo bar.zip', 'foo bar.zip'),
+    ('attachment; name="x; filename=evil.zip"; filename=real.zip', 'real.zip'),
+    ('attachment', 'url.zip'),
+    (None, 'url.zip'),
+])
+def test_extract_filename(content_disposition, filename):
+    headers = CIMultiDict()
+    if content_disposition is not None:
+        headers['Content-Disposition'] = content_disposition
+    response = SimpleNamespace(headers=headers, url=URL('https://example.com/url.zip'))
+    assert extract_filename(response) == filename
+
+
 def test_loading_toc_from_path(fake_addon):
     TocReader.from_path(fake_addon / 'FakeAddon.toc')
     with pytest.raises(FileNotFoundError):